@@ -27,28 +27,39 @@ class BaseCollection(object):
 
 class Collection(BaseCollection):
     def __len__(self):
-        query_params = self._get_query_params()
+        return self.count()
+
+    def count(self):
+        """
+        Get the number of items in the collection, without fetching the items themselves.
+        """
+        query_params = dict(self._get_query_params() or {}, per_page=1)
         response = self._api_client.api_request(self._get_url(), query_params=query_params)
         return response["count"]
 
     def __iter__(self):
-        for chunk in self._iter_chunks():
-            for obj in chunk:
-                yield obj
+        for item_data in self._iter_raw_items():
+            yield self._obj_class(self._api_client, item_data)
 
-    def _iter_chunks(self):
+    def _iter_raw_items(self, page_size=None):
         query_params = self._get_query_params()
+        if page_size:
+            query_params = dict(query_params or {}, per_page=page_size)
         response = self._api_client.api_request(self._get_url(), query_params=query_params)
-        results = response["results"]
         while True:
-            yield [self._obj_class(self._api_client, obj) for obj in results]
+            for item_data in response["results"]:
+                yield item_data
 
             # Get the next batch of objects if possible
-            if response.get("next"):
-                response = self._api_client.api_request(response["next"], query_params=query_params)
-                results = response["results"]
-            else:
+            if not response.get("next"):
                 return
+            response = self._api_client.api_request(response["next"], query_params=query_params)
+
+    def ids(self):
+        """
+        Get the IDs of all the items in the collection, without building an object for each item.
+        """
+        return [item_data["id"] for item_data in self._iter_raw_items(page_size=ENTRIES_PER_PAGE)]
 
     def _get_url(self):
         return self._api_client.api_urls[self._obj_class.NAME]
@@ -90,17 +101,22 @@ class EditableCollection(Collection):
         return self._obj_class(self._api_client, response).load()
 
 
-class UnpaginatedEditableCollection(EditableCollection):
-    def __len__(self):
-        query_params = self._get_query_params()
-        response = self._api_client.api_request(self._get_url(), query_params=query_params)
-        return len(response)
+class UnpaginatedCollection(Collection):
+    def count(self):
+        """
+        Get the number of items in the collection.
+        """
+        return sum(1 for _ in self._iter_raw_items())
 
-    def __iter__(self):
+    def _iter_raw_items(self, page_size=None):
+        # The whole collection is always returned in a single response
         query_params = self._get_query_params()
         response = self._api_client.api_request(self._get_url(), query_params=query_params)
-        for item_data in response:
-            yield self._obj_class(self._api_client, item_data)
+        return iter(response)
+
+
+class UnpaginatedEditableCollection(UnpaginatedCollection, EditableCollection):
+    pass
 
 
 class RelatedCollection(BaseCollection):
@@ -1114,6 +1130,29 @@ class Endpoint(Entity):
         self._api_client.endpoints.clear_deployment_group([self])
 
 
+class _ResponseLinesIterator(object):
+    """
+    Iterate over the lines of a streamed response, and close it when they run out or when
+    close() is called.
+    """
+    def __init__(self, response):
+        self._response = response
+        self._lines = response.iter_lines()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return next(self._lines)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        self._response.close()
+
+
 class EndpointCollection(EditableCollection):
     """
     A subset of the endpoints in the system.
@@ -1297,11 +1336,22 @@ class EndpointCollection(EditableCollection):
                                          "selected_endpoints_ids": endpoints_ids,
                                      })
 
-    def export_filtered(self):
+    def export_filtered(self, stream=False):
         """
         Export all filtered endpoints to CSV.
+
+        :param stream: If True, return an iterator over the CSV lines as they are received, \
+            instead of the whole CSV content. If the iterator isn't exhausted, call its close() \
+            method to release the connection.
         """
-        return self._api_client.api_request(url="{}{}".format(self._get_url(), "export/"),
+        url = "{}{}".format(self._get_url(), "export/")
+        if stream:
+            response = self._api_client.api_request(url=url,
+                                                    query_params=self._get_query_params(),
+                                                    stream=True)
+            return _ResponseLinesIterator(response)
+
+        return self._api_client.api_request(url=url,
                                             query_params=self._get_query_params(),
                                             expect_json_response=False)
 
@@ -1393,7 +1443,7 @@ class AlertPolicy(BaseEntity):
         self._update_entity_data(response)
 
 
-class AlertPolicyCollection(Collection):
+class AlertPolicyCollection(UnpaginatedCollection):
     """
     A subset of the alert policies (aka system-wide rules) in the system.
 
@@ -1401,17 +1451,6 @@ class AlertPolicyCollection(Collection):
     """
     MODEL_CLASS = AlertPolicy
 
-    def __len__(self):
-        query_params = self._get_query_params()
-        response = self._api_client.api_request(self._get_url(), query_params=query_params)
-        return len(response)
-
-    def __iter__(self):
-        query_params = self._get_query_params()
-        response = self._api_client.api_request(self._get_url(), query_params=query_params)
-        for item_data in response:
-            yield self._obj_class(self._api_client, item_data)
-
     def reset_all_to_default(self):
         """
         Reset the 'to_status' of all alert policies to their original system default.
@@ -1,20 +1,26 @@
-import StringIO
 import csv
 import datetime
+import errno
 import json
 import logging
 import shutil
+import zipfile
+from contextlib import closing, contextmanager
 from stat import S_IRUSR
 
 import pytest
+import requests
+import requests_mock
 from retrying import retry
-from subprocess import Popen
+from subprocess import check_call
+from multiprocessing.pool import ThreadPool
 
 import mazerunner
 import os
 
 from mazerunner.api_client import Service, AlertPolicy, Decoy, Breadcrumb, \
-    DeploymentGroup, Endpoint, CIDRMapping, BackgroundTask, AuditLogLine, ISO_TIME_FORMAT
+    DeploymentGroup, Endpoint, CIDRMapping, BackgroundTask, AuditLogLine, \
+    ENTRIES_PER_PAGE, ISO_TIME_FORMAT
 from mazerunner.exceptions import ValidationError, ServerError, BadParamError, \
     InvalidInstallMethodError
 from utils import TimeoutException, wait_until
@@ -56,11 +62,81 @@ class AlertNotFoundError(RuntimeError):
     pass
 
 
+@pytest.fixture(scope='session')
+def json_credentials():
+    with open(pytest.config.option.json_credentials, 'rb') as file_reader:
+        return json.load(file_reader)
+
+
+@pytest.fixture(scope='session')
+def mazerunner_client(json_credentials):
+    return mazerunner.connect(
+        ip_address=json_credentials[MAZERUNNER_IP_ADDRESS_PARAM],
+        api_key=json_credentials[API_ID_PARAM],
+        api_secret=json_credentials[API_SECRET_PARAM],
+        certificate=json_credentials[MAZERUNNER_CERTIFICATE_PATH_PARAM])
+
+
+def _run_concurrently(func, iterable, processes=4):
+    pool = ThreadPool(processes)
+    try:
+        # One item per task, so a failure doesn't skip the rest of its chunk
+        return pool.map(func, iterable, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _call_concurrently(*funcs):
+    """
+    Call the given functions concurrently, and return their results in the same order.
+    """
+    return _run_concurrently(lambda func: func(), funcs, processes=len(funcs))
+
+
+@contextmanager
+def _kept_between_tests(*entities):
+    """
+    Whitelist the given entities in ENTITIES_CONFIGURATION so the per-test cleanup leaves them
+    alone, and delete them (in the given order) when done.
+    """
+    for entity in entities:
+        ENTITIES_CONFIGURATION[type(entity)].append(entity.id)
+
+    try:
+        yield
+    finally:
+        for entity in entities:
+            ENTITIES_CONFIGURATION[type(entity)].remove(entity.id)
+
+        delete_error = None
+        for entity in entities:
+            try:
+                wait_until(entity.delete, exc_list=[ServerError, ValidationError],
+                           check_return_value=False)
+            except Exception as e:
+                delete_error = delete_error or e
+
+        if delete_error:
+            raise delete_error
+
+
+def _entity_names(collection):
+    return {entity.name for entity in collection}
+
+
 def _clear_deployment_path():
-    if os.path.exists(TEST_DEPLOYMENTS_FOLDER_PATH):
-        shutil.rmtree(TEST_DEPLOYMENTS_FOLDER_PATH)
+    if not os.path.isdir(TEST_DEPLOYMENTS_FOLDER_PATH):
+        os.makedirs(TEST_DEPLOYMENTS_FOLDER_PATH)
+        return
 
-    os.makedirs(TEST_DEPLOYMENTS_FOLDER_PATH)
+    # empty the folder without recreating it
+    for entry_name in os.listdir(TEST_DEPLOYMENTS_FOLDER_PATH):
+        entry_path = os.path.join(TEST_DEPLOYMENTS_FOLDER_PATH, entry_name)
+        if os.path.isdir(entry_path) and not os.path.islink(entry_path):
+            shutil.rmtree(entry_path)
+        else:
+            os.remove(entry_path)
 
 
 class MachineStatus(object):
@@ -77,14 +153,22 @@ class APITest(object):
     lab_dependent = pytest.mark.skipif(not pytest.config.getoption('--lab_dependent'),
                                        reason='--lab_dependent not activated')
 
+    def _list_disposable_entities(self):
+        entities_lists = _run_concurrently(list, self.disposable_entities,
+                                           processes=len(self.disposable_entities))
+        return zip(self.disposable_entities, entities_lists)
+
     def _assert_clean_system(self):
-        for entity_collection in self.disposable_entities:
-            existing_ids = {entity.id for entity in entity_collection}
+        ids_lists = _run_concurrently(lambda entity_collection: entity_collection.ids(),
+                                      self.disposable_entities,
+                                      processes=len(self.disposable_entities))
+        for entity_collection, ids in zip(self.disposable_entities, ids_lists):
+            existing_ids = set(ids)
             expected_ids = set(ENTITIES_CONFIGURATION[entity_collection.MODEL_CLASS])
 
             assert existing_ids == expected_ids, CLEAR_SYSTEM_ERROR_MESSAGE
 
-        assert len(self.background_tasks) == 0, CLEAR_SYSTEM_ERROR_MESSAGE
+        assert self.background_tasks.count() == 0, CLEAR_SYSTEM_ERROR_MESSAGE
 
     def _configure_entities_groups(self):
         self.decoys = self.client.decoys
@@ -107,26 +191,20 @@ class APITest(object):
             self.cidr_mappings
         ]
 
-    def setup_method(self, method):
-        logger.debug("setup_method called")
-
-        with open(pytest.config.option.json_credentials, 'rb') as file_reader:
-            json_dict = json.load(file_reader)
+    @pytest.fixture(autouse=True)
+    def _api_test(self, json_credentials, mazerunner_client):
+        logger.debug("_api_test called")
 
-        self.lab_endpoint_ip = json_dict.get(ENDPOINT_IP_PARAM)
-        self.lab_endpoint_user = json_dict.get(ENDPOINT_USERNAME_PARAM)
-        self.lab_endpoint_password = json_dict.get(ENDPOINT_PASSWORD_PARAM)
+        self.lab_endpoint_ip = json_credentials.get(ENDPOINT_IP_PARAM)
+        self.lab_endpoint_user = json_credentials.get(ENDPOINT_USERNAME_PARAM)
+        self.lab_endpoint_password = json_credentials.get(ENDPOINT_PASSWORD_PARAM)
 
-        self.mazerunner_ip_address = json_dict[MAZERUNNER_IP_ADDRESS_PARAM]
-        self.api_key = json_dict[API_ID_PARAM]
-        self.api_secret = json_dict[API_SECRET_PARAM]
-        self.mazerunner_certificate_path = json_dict[MAZERUNNER_CERTIFICATE_PATH_PARAM]
+        self.mazerunner_ip_address = json_credentials[MAZERUNNER_IP_ADDRESS_PARAM]
+        self.api_key = json_credentials[API_ID_PARAM]
+        self.api_secret = json_credentials[API_SECRET_PARAM]
+        self.mazerunner_certificate_path = json_credentials[MAZERUNNER_CERTIFICATE_PATH_PARAM]
 
-        self.client = mazerunner.connect(
-            ip_address=self.mazerunner_ip_address,
-            api_key=self.api_key,
-            api_secret=self.api_secret,
-            certificate=self.mazerunner_certificate_path)
+        self.client = mazerunner_client
 
         self._configure_entities_groups()
 
@@ -139,29 +217,46 @@ class APITest(object):
 
         _clear_deployment_path()
 
-    def _destroy_new_entities(self):
-        for entity_collection in self.disposable_entities:
-            for entity in list(entity_collection):
-                initial_ids = ENTITIES_CONFIGURATION[entity_collection.MODEL_CLASS]
-                if entity.id not in initial_ids:
-                    wait_until(entity.delete, exc_list=[ServerError, ValidationError],
-                               check_return_value=False)
-
-        self.background_tasks.acknowledge_all_complete()
+        yield
 
-        wait_until(self._assert_clean_system, exc_list=[AssertionError], check_return_value=False)
-
-    def teardown_method(self, method):
-        logger.debug("teardown_method called")
+        logger.debug("_api_test teardown called")
 
         self._destroy_new_entities()
 
         # Clean files:
         for file_path in self.file_paths_for_cleanup:
-            if os.path.exists(file_path):
+            try:
                 os.remove(file_path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
         _clear_deployment_path()
 
+    def _destroy_new_entities(self):
+        new_entities = [entity
+                        for entity_collection, entities in self._list_disposable_entities()
+                        for entity in entities
+                        if entity.id not in ENTITIES_CONFIGURATION[entity_collection.MODEL_CLASS]]
+
+        # batch delete the endpoints
+        new_endpoints_ids = [entity.id for entity in new_entities if isinstance(entity, Endpoint)]
+        if new_endpoints_ids:
+            wait_until(self.endpoints.delete_by_endpoints_ids, endpoints_ids=new_endpoints_ids,
+                       exc_list=[ServerError, ValidationError], check_return_value=False)
+
+        def _delete(entity):
+            wait_until(entity.delete, exc_list=[ServerError, ValidationError],
+                       check_return_value=False)
+
+        # Every deletion is attempted even if one of them fails. Deletions that depend on
+        # another one (e.g. a service still attached to a decoy) are retried until it's done
+        _run_concurrently(_delete, [entity for entity in new_entities
+                                    if not isinstance(entity, Endpoint)])
+
+        self.background_tasks.acknowledge_all_complete()
+
+        wait_until(self._assert_clean_system, exc_list=[AssertionError], check_return_value=False)
+
     def valid_decoy_status(self, decoy, wanted_statuses):
         logger.debug("valid_decoy_status called")
         decoy.load()
@@ -177,7 +272,9 @@ class APITest(object):
                 wanted_statuses=wanted_statuses,
                 check_return_value=True,
                 total_timeout=timeout,
-                interval=1,
+                interval=0.25,
+                backoff=1.4,
+                max_interval=8,
                 exc_list=[Exception]
             )
             return True
@@ -207,10 +304,10 @@ class APITest(object):
         logger.info("decoy {0} is inactive".format(decoy.name))
 
     def assert_entity_name_in_collection(self, entity_name, collection):
-        assert any(entity.name == entity_name for entity in collection)
+        assert entity_name in _entity_names(collection)
 
     def assert_entity_name_not_in_collection(self, entity_name, collection):
-        assert not any(entity.name == entity_name for entity in collection)
+        assert entity_name not in _entity_names(collection)
 
 
 SSH_GROUP_NAME = "ssh_deployment_group"
@@ -235,12 +332,11 @@ class TestGeneralFlow(APITest):
         logger.debug("test_api_setup_campaign called")
 
         # Create deployment group:
-        assert {dg.id for dg in self.deployment_groups} == \
-               set(ENTITIES_CONFIGURATION[DeploymentGroup])
+        assert set(self.deployment_groups.ids()) == set(ENTITIES_CONFIGURATION[DeploymentGroup])
         deployment_group = self.deployment_groups.create(name=SSH_GROUP_NAME,
                                                          description="test deployment group")
         self.assert_entity_name_in_collection(SSH_GROUP_NAME, self.deployment_groups)
-        assert {dg.id for dg in self.deployment_groups} == \
+        assert set(self.deployment_groups.ids()) == \
             set(ENTITIES_CONFIGURATION[DeploymentGroup] + [deployment_group.id])
 
         # Create breadcrumb:
@@ -250,14 +346,16 @@ class TestGeneralFlow(APITest):
                                                  username="ssh_user",
                                                  password="ssh_pass",
                                                  deployment_groups=[deployment_group.id])
-        self.assert_entity_name_in_collection(SSH_BREADCRUMB_NAME, self.breadcrumbs)
-        assert len(self.breadcrumbs) == 1
+        breadcrumbs = list(self.breadcrumbs)
+        self.assert_entity_name_in_collection(SSH_BREADCRUMB_NAME, breadcrumbs)
+        assert len(breadcrumbs) == 1
 
         # Create service:
         assert len(self.services) == 0
         service_ssh = self.services.create(name=SSH_SERVICE_NAME, service_type="ssh", any_user="false")
-        self.assert_entity_name_in_collection(SSH_SERVICE_NAME, self.services)
-        assert len(self.services) == 1
+        services = list(self.services)
+        self.assert_entity_name_in_collection(SSH_SERVICE_NAME, services)
+        assert len(services) == 1
 
         # Create decoy:
         assert len(self.decoys) == 0
@@ -265,15 +363,14 @@ class TestGeneralFlow(APITest):
                                            hostname="decoyssh",
                                            os="Ubuntu_1404",
                                            vm_type="KVM"))
-        self.assert_entity_name_in_collection(SSH_DECOY_NAME, self.decoys)
-        assert len(self.decoys) == 1
+        decoys = list(self.decoys)
+        self.assert_entity_name_in_collection(SSH_DECOY_NAME, decoys)
+        assert len(decoys) == 1
 
         service_ssh.load()
         breadcrumb_ssh.load()
         assert len(service_ssh.available_decoys) == 1
         assert len(service_ssh.attached_decoys) == 0
-        assert len(service_ssh.available_decoys) == 1
-        assert len(service_ssh.attached_decoys) == 0
         assert len(breadcrumb_ssh.available_services) == 1
         assert len(breadcrumb_ssh.attached_services) == 0
 
@@ -287,8 +384,6 @@ class TestGeneralFlow(APITest):
         breadcrumb_ssh.load()
         assert len(service_ssh.available_decoys) == 0
         assert len(service_ssh.attached_decoys) == 1
-        assert len(service_ssh.available_decoys) == 0
-        assert len(service_ssh.attached_decoys) == 1
         assert len(breadcrumb_ssh.available_services) == 0
         assert len(breadcrumb_ssh.attached_services) == 1
 
@@ -315,11 +410,13 @@ class TestGeneralFlow(APITest):
 
         # Edit deployment group:
         deployment_group.update(name=SSH_GROUP_NAME_UPDATE, description="test group")
-        self.assert_entity_name_in_collection(SSH_GROUP_NAME_UPDATE, self.deployment_groups)
-        self.assert_entity_name_not_in_collection(SSH_GROUP_NAME, self.deployment_groups)
+        deployment_groups = list(self.deployment_groups)
+        self.assert_entity_name_in_collection(SSH_GROUP_NAME_UPDATE, deployment_groups)
+        self.assert_entity_name_not_in_collection(SSH_GROUP_NAME, deployment_groups)
         deployment_group.partial_update(name=SSH_GROUP_NAME)
-        self.assert_entity_name_in_collection(SSH_GROUP_NAME, self.deployment_groups)
-        self.assert_entity_name_not_in_collection(SSH_GROUP_NAME_UPDATE, self.deployment_groups)
+        deployment_groups = list(self.deployment_groups)
+        self.assert_entity_name_in_collection(SSH_GROUP_NAME, deployment_groups)
+        self.assert_entity_name_not_in_collection(SSH_GROUP_NAME_UPDATE, deployment_groups)
 
         service_ssh.update(name=SSH_SERVICE_NAME_UPDATE, any_user="false")
 
@@ -345,19 +442,20 @@ class TestGeneralFlow(APITest):
         self.file_paths_for_cleanup.append(downloaded_docx_file_path)
         deployment_group = self.deployment_groups.create(name=HONEYDOC_GROUP_NAME,
                                                          description="test deployment group")
-        breadcrumb_honeydoc = self.breadcrumbs.create(name=HONEYDOC_BREADCRUMB_NAME,
-                                                      breadcrumb_type="honey_doc",
-                                                      deployment_groups=[deployment_group.id],
-                                                      monitor_from_external_host=False,
-                                                      file_field_name="docx_file_content",
-                                                      file_path="test/sample.docx")
-        service_honeydoc = self.services.create(name=HONEYDOC_SERVICE_NAME,
-                                                service_type="honey_doc",
-                                                server_suffix=HONEYDOC_SERVICE_SERVER_SUFFIX)
-        decoy_honeydoc = self.create_decoy(dict(name=HONEYDOC_DECOY_NAME,
-                                                hostname="decoyhoneydoc",
-                                                os="Ubuntu_1404",
-                                                vm_type="KVM"))
+        breadcrumb_honeydoc, service_honeydoc, decoy_honeydoc = _call_concurrently(
+            lambda: self.breadcrumbs.create(name=HONEYDOC_BREADCRUMB_NAME,
+                                            breadcrumb_type="honey_doc",
+                                            deployment_groups=[deployment_group.id],
+                                            monitor_from_external_host=False,
+                                            file_field_name="docx_file_content",
+                                            file_path="test/sample.docx"),
+            lambda: self.services.create(name=HONEYDOC_SERVICE_NAME,
+                                         service_type="honey_doc",
+                                         server_suffix=HONEYDOC_SERVICE_SERVER_SUFFIX),
+            lambda: self.create_decoy(dict(name=HONEYDOC_DECOY_NAME,
+                                           hostname="decoyhoneydoc",
+                                           os="Ubuntu_1404",
+                                           vm_type="KVM")))
         service_honeydoc.load()
         breadcrumb_honeydoc.load()
         self.assert_entity_name_in_collection(HONEYDOC_GROUP_NAME, breadcrumb_honeydoc.deployment_groups)
@@ -427,7 +525,7 @@ class TestDecoy(APITest):
         _assert_expected_values()
 
     @classmethod
-    @retry(stop_max_attempt_number=600, wait_fixed=1000)
+    @retry(wait_exponential_multiplier=250, wait_exponential_max=8000, stop_max_delay=600000)
     def _wait_for_decoy_status(cls, decoy, desired_status):
         assert decoy.load().machine_status == desired_status
 
@@ -464,6 +562,28 @@ class TestDecoy(APITest):
 
 class TestDeploymentGroups(APITest):
 
+    @pytest.fixture(scope='class')
+    def ssh_decoy_service(self, mazerunner_client):
+        # Class-scoped fixtures don't run on the test's instance, hence the client setup
+        self.client = mazerunner_client
+        self._configure_entities_groups()
+
+        # Whitelist each entity as soon as it's created, so it's deleted even if the setup fails
+        decoy_ssh = self.decoys.create(name=SSH_DECOY_NAME,
+                                       hostname="decoyssh",
+                                       os="Ubuntu_1404",
+                                       vm_type="KVM")
+        with _kept_between_tests(decoy_ssh):
+            self.wait_for_decoy_status(decoy_ssh, wanted_statuses=[MachineStatus.NOT_SEEN],
+                                       timeout=60*5)
+
+            service_ssh = self.services.create(name=SSH_SERVICE_NAME, service_type="ssh",
+                                               any_user="false")
+            with _kept_between_tests(service_ssh):
+                service_ssh.connect_to_decoy(decoy_ssh.id)
+
+                yield decoy_ssh, service_ssh
+
     def test_basic_crud(self):
         dep_group = self.deployment_groups.create(name='test_check_conflicts')
         dep_group.update(name='test_check_conflicts1', description='pretty dg')
@@ -472,13 +592,8 @@ class TestDeploymentGroups(APITest):
         with pytest.raises(ValidationError):
             self.deployment_groups.get_item(dep_group.id)
 
-    def test_check_conflicts(self):
-        decoy_ssh = self.create_decoy(dict(name=SSH_DECOY_NAME,
-                                           hostname="decoyssh",
-                                           os="Ubuntu_1404",
-                                           vm_type="KVM"))
-        service_ssh = self.services.create(name=SSH_SERVICE_NAME, service_type="ssh", any_user="false")
-        service_ssh.connect_to_decoy(decoy_ssh.id)
+    def test_check_conflicts(self, ssh_decoy_service):
+        _, service_ssh = ssh_decoy_service
 
         dep_group = self.deployment_groups.create(name='test_check_conflicts')
 
@@ -516,13 +631,8 @@ class TestDeploymentGroups(APITest):
             }
         ]
 
-    def test_deployment(self):
-        decoy_ssh = self.create_decoy(dict(name=SSH_DECOY_NAME,
-                                           hostname="decoyssh",
-                                           os="Ubuntu_1404",
-                                           vm_type="KVM"))
-
-        service_ssh = self.services.create(name=SSH_SERVICE_NAME, service_type="ssh", any_user="false")
+    def test_deployment(self, ssh_decoy_service):
+        decoy_ssh, service_ssh = ssh_decoy_service
 
         bc_ssh = self.breadcrumbs.create(name='ssh1',
                                          breadcrumb_type="ssh",
@@ -531,14 +641,11 @@ class TestDeploymentGroups(APITest):
 
         dep_group = self.deployment_groups.create(name='test_check_conflicts')
 
-        service_ssh.connect_to_decoy(decoy_ssh.id)
         bc_ssh.connect_to_service(service_ssh.id)
         bc_ssh.add_to_group(dep_group.id)
 
-        self.power_on_decoy(decoy_ssh)
-
         def _has_complete_bg_tasks():
-            return len([bg_task for bg_task in self.background_tasks.filter(running=False)]) > 0
+            return len(self.background_tasks.filter(running=False)) > 0
 
         def _wait_and_destroy_background_task():
             wait_until(_has_complete_bg_tasks, check_return_value=True)
@@ -586,8 +693,13 @@ class TestDeploymentGroups(APITest):
 
             _wait_and_destroy_background_task()
 
-        _test_manual_deployment()
-        _test_auto_deployment()
+        # test_check_conflicts expects the shared decoy to be powered off
+        self.power_on_decoy(decoy_ssh)
+        try:
+            _test_manual_deployment()
+            _test_auto_deployment()
+        finally:
+            self.power_off_decoy(decoy_ssh)
 
     def forensic_puller_alert_is_shown(self):
         alerts = list(self.alerts.filter(filter_enabled=True,
@@ -603,41 +715,26 @@ class TestDeploymentGroups(APITest):
         wait_until(self.forensic_puller_alert_is_shown)
 
     @APITest.lab_dependent
-    def test_deployment_credentials(self):
-        assert self.client.deployment_groups.test_deployment_credentials(
-            username=self.lab_endpoint_user,
-            password=self.lab_endpoint_password,
-            addr=self.lab_endpoint_ip,
-            install_method='PS_EXEC',
-            domain=None
-        ) == {'success': True}
-
-        assert self.client.deployment_groups.test_deployment_credentials(
-            username=self.lab_endpoint_user,
-            password=self.lab_endpoint_password,
-            addr='192.168.100.100',
-            install_method='PS_EXEC',
-            domain=None
-        ) == {
+    @pytest.mark.parametrize("overrides, expected_result", [
+        ({}, {'success': True}),
+        ({'addr': '192.168.100.100'}, {
             u'reason': u'Endpoint SMB TCP Ports(139, 445) are unreachable',
             u'success': False
-        }
-
-        assert self.client.deployment_groups.test_deployment_credentials(
-            username=self.lab_endpoint_user,
-            password='WrongPassword',
-            addr=self.lab_endpoint_ip,
-            install_method='PS_EXEC',
-            domain=None
-        ) == {u'reason': u'Incorrect credentials for endpoint', u'success': False}
-
-        assert self.client.deployment_groups.test_deployment_credentials(
-            username='WrongUser',
-            password=self.lab_endpoint_password,
-            addr=self.lab_endpoint_ip,
-            install_method='PS_EXEC',
-            domain=None
-        ) == {u'reason': u'Incorrect credentials for endpoint', u'success': False}
+        }),
+        ({'password': 'WrongPassword'},
+         {u'reason': u'Incorrect credentials for endpoint', u'success': False}),
+        ({'username': 'WrongUser'},
+         {u'reason': u'Incorrect credentials for endpoint', u'success': False}),
+    ], ids=['valid', 'unreachable_addr', 'wrong_password', 'wrong_username'])
+    def test_deployment_credentials(self, overrides, expected_result):
+        credentials = dict(username=self.lab_endpoint_user,
+                           password=self.lab_endpoint_password,
+                           addr=self.lab_endpoint_ip,
+                           install_method='PS_EXEC',
+                           domain=None)
+        credentials.update(overrides)
+        assert self.client.deployment_groups.test_deployment_credentials(**credentials) == \
+            expected_result
 
 
 class TestCollections(APITest):
@@ -648,12 +745,14 @@ class TestCollections(APITest):
                                      for breadcrumb_num
                                      in range(breadcrumbs_to_create)]
 
-        for breadcrumb_name in created_breadcrumbs_names:
+        def _create_breadcrumb(breadcrumb_name):
             self.breadcrumbs.create(name=breadcrumb_name,
                                     breadcrumb_type="ssh",
                                     username="ssh_user",
                                     password="ssh_pass")
 
+        _run_concurrently(_create_breadcrumb, created_breadcrumbs_names, processes=10)
+
         assert len(self.breadcrumbs) == breadcrumbs_to_create
         fetched_breadcrumbs = [breadcrumb for breadcrumb in self.breadcrumbs]
         assert len(fetched_breadcrumbs) == breadcrumbs_to_create
@@ -673,11 +772,6 @@ class TestCollections(APITest):
         with pytest.raises(ValidationError):
             assert self.breadcrumbs.get_item(breadcrumb.id + 1)
 
-    def test_params(self):
-        assert type(self.decoys.params()) == dict
-        assert type(self.services.params()) == dict
-        assert type(self.breadcrumbs.params()) == dict
-
 
 def _get_breadcrumb_config(breadcrumb):
     breadcrumb.deploy(
@@ -687,13 +781,8 @@ def _get_breadcrumb_config(breadcrumb):
         download_format='ZIP'
     )
 
-    Popen(['unzip', TEST_DEPLOYMENTS_FILE_PATH], cwd=TEST_DEPLOYMENTS_FOLDER_PATH)
-    config_file_path = '%s/utils/config.json' % TEST_DEPLOYMENTS_FOLDER_PATH
-
-    wait_until(os.path.exists, path=config_file_path)
-
-    with open(config_file_path, 'rb') as f:
-        return json.load(f)
+    with zipfile.ZipFile(TEST_DEPLOYMENTS_FILE_PATH) as deployment_file:
+        return json.loads(deployment_file.read('utils/config.json'))
 
 
 def _create_private_keys_from_config(config):
@@ -717,50 +806,55 @@ def _create_private_keys_from_config(config):
 
 
 class TestAlert(APITest):
-    def test_alert_download(self):
+    def test_alert_download(self, tmpdir):
         def _create_code_exec_alert():
-            decoy_ssh = self.create_decoy(dict(name=SSH_DECOY_NAME,
+            decoy_ssh, service_ssh, bc_ssh1 = _call_concurrently(
+                lambda: self.create_decoy(dict(name=SSH_DECOY_NAME,
                                                hostname="decoyssh",
                                                os="Ubuntu_1404",
-                                               vm_type="KVM"))
-            service_ssh = self.services.create(name=SSH_SERVICE_NAME, service_type="ssh", any_user="false")
+                                               vm_type="KVM")),
+                lambda: self.services.create(name=SSH_SERVICE_NAME,
+                                             service_type="ssh",
+                                             any_user="false"),
+                lambda: self.breadcrumbs.create(name='ssh1',
+                                                breadcrumb_type="ssh_privatekey",
+                                                username="ssh_user",
+                                                deploy_for="root",
+                                                installation_type='history'))
             service_ssh.connect_to_decoy(decoy_ssh.id)
-
-            bc_ssh1 = self.breadcrumbs.create(name='ssh1',
-                                              breadcrumb_type="ssh_privatekey",
-                                              username="ssh_user",
-                                              deploy_for="root",
-                                              installation_type='history')
             bc_ssh1.connect_to_service(service_ssh.id)
             self.power_on_decoy(decoy_ssh)
 
             config = _get_breadcrumb_config(bc_ssh1)
-            login_str, private_key_path = _create_private_keys_from_config(config).next()
-
-            Popen(['ssh', '-o', 'UserKnownHostsFile=/dev/null', '-o',
-                   'StrictHostKeyChecking=no', login_str, '-i', private_key_path,
-                   'ping -c 10 localhost'])
-
-            wait_until(self._get_first_code_execution_alert, exc_list=[AlertNotFoundError])
-
-            return self._get_first_code_execution_alert()
+            # only the first key is written to disk
+            login_str, private_key_path = next(_create_private_keys_from_config(config))
+
+            # A single command is enough to trigger the alert. BatchMode fails instead of
+            # prompting for a password if the key is rejected, and the keepalive settings drop
+            # a stalled session instead of hanging
+            check_call(['ssh', '-o', 'UserKnownHostsFile=/dev/null', '-o',
+                        'StrictHostKeyChecking=no', '-o', 'BatchMode=yes', '-o',
+                        'ConnectTimeout=5', '-o', 'ServerAliveInterval=5', '-o',
+                        'ServerAliveCountMax=3', login_str, '-i', private_key_path,
+                        'ping -c 1 localhost'])
+
+            return wait_until(self._get_first_code_execution_alert,
+                              exc_list=[AlertNotFoundError],
+                              interval=0.25,
+                              backoff=1.3)
 
         def _test_download_alert_files(code_exec_alert):
-            image_file = '%s/image' % TEST_DEPLOYMENTS_FOLDER_PATH
-            code_exec_alert.download_image_file(image_file)
-            assert os.path.exists('%s.bin' % image_file)
-
-            mem_dump = '%s/mem_dump' % TEST_DEPLOYMENTS_FOLDER_PATH
-            code_exec_alert.download_memory_dump_file(mem_dump)
-            assert os.path.exists('%s.bin' % mem_dump)
+            downloads = [
+                (code_exec_alert.download_image_file, str(tmpdir.join('image')), 'bin'),
+                (code_exec_alert.download_memory_dump_file, str(tmpdir.join('mem_dump')), 'bin'),
+                (code_exec_alert.download_network_capture_file, str(tmpdir.join('netcap')), 'pcap'),
+                (code_exec_alert.download_stix_file, str(tmpdir.join('stix')), 'xml')
+            ]
 
-            netcap_file = '%s/netcap' % TEST_DEPLOYMENTS_FOLDER_PATH
-            code_exec_alert.download_network_capture_file(netcap_file)
-            assert os.path.exists('%s.pcap' % netcap_file)
+            _run_concurrently(lambda download: download[0](download[1]), downloads)
 
-            stix_file = '%s/stix' % TEST_DEPLOYMENTS_FOLDER_PATH
-            code_exec_alert.download_stix_file(stix_file)
-            assert os.path.exists('%s.xml' % stix_file)
+            for _, file_path, extension in downloads:
+                assert os.path.exists('%s.%s' % (file_path, extension))
 
         def _test_delete_single_alert(code_exec_alert):
             code_exec_alert.delete()
@@ -769,7 +863,7 @@ class TestAlert(APITest):
                 self.alerts.get_item(code_exec_alert.id)
 
         def _test_export():
-            export_file = '%s/export' % TEST_DEPLOYMENTS_FOLDER_PATH
+            export_file = str(tmpdir.join('export'))
             self.alerts.export(export_file)
             assert os.path.exists('%s.csv' % export_file)
 
@@ -787,37 +881,98 @@ class TestAlert(APITest):
         _test_delete_filtered_alerts()
 
     def _get_first_code_execution_alert(self):
-        alerts = list(self.alerts.filter(filter_enabled=True,
+        alerts = iter(self.alerts.filter(filter_enabled=True,
                                          only_alerts=True,
                                          alert_types=[CODE_EXECUTION_ALERT_TYPE]))
-        if not alerts:
+        try:
+            return next(alerts)
+        except StopIteration:
             raise AlertNotFoundError
 
-        return alerts[0]
-
     def test_params(self):
         assert isinstance(self.alerts.params(), dict)
 
 
-class TestEntity(APITest):
-    def test_repr(self):
-        service = self.services.create(name=SSH_SERVICE_NAME, service_type="ssh", any_user="false")
+OFFLINE_HOST = 'mazerunner.test'
+OFFLINE_API_URL = 'https://%s/api/v1.0/' % OFFLINE_HOST
+OFFLINE_API_URLS = {name: '%s%s/' % (OFFLINE_API_URL, name)
+                    for name in ('decoy', 'service', 'breadcrumb', 'endpoint', 'cidr-mapping')}
+OFFLINE_SERVICE_ID = 8
+
+# The client only accepts JSON responses with the matching content type
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+@pytest.fixture
+def offline_server():
+    with requests_mock.Mocker() as mocker:
+        mocker.get(OFFLINE_API_URL, json=OFFLINE_API_URLS, headers=JSON_HEADERS)
+        yield mocker
+
+
+@pytest.fixture
+def offline_client(offline_server):
+    return mazerunner.connect(ip_address=OFFLINE_HOST,
+                              api_key='api_key',
+                              api_secret='api_secret',
+                              certificate=None)
+
+
+class TestEntityOffline(object):
+    """
+    Client side tests, which run against canned responses rather than a MazeRunner server.
+    """
+
+    @pytest.fixture(autouse=True)
+    def _service_responses(self, offline_server):
+        service_url = '%s%s/' % (OFFLINE_API_URLS['service'], OFFLINE_SERVICE_ID)
+        service_data = {
+            'id': OFFLINE_SERVICE_ID,
+            'url': service_url,
+            'name': SSH_SERVICE_NAME,
+            'service_type': 'ssh',
+            'service_type_name': 'SSH',
+            'is_active': False,
+            'is_delete_enabled': True,
+            'any_user': False,
+            'available_decoys': [],
+            'attached_decoys': []
+        }
 
-        str_service = "<Service: available_decoys=[] name=u'ssh_service' service_type_name=u'SSH' " \
-                      "url=u'https://{serv}/api/v1.0/service/{service_id}/' " \
-                      "is_active=False attached_decoys=[] any_user={any_user} is_delete_enabled=True " \
-                      "service_type=u'ssh' id={service_id}>"\
-            .format(serv=self.mazerunner_ip_address, service_id=service.id, any_user=service.any_user)
-        assert str(service) == str_service
+        offline_server.get(service_url, json=service_data, headers=JSON_HEADERS)
+        offline_server.get('%s%s/' % (OFFLINE_API_URLS['service'], OFFLINE_SERVICE_ID + 1),
+                           status_code=404)
+        for url in OFFLINE_API_URLS.values():
+            offline_server.get('%sparams/' % url, json={}, headers=JSON_HEADERS)
+
+    def test_repr(self, offline_client):
+        service = offline_client.services.get_item(OFFLINE_SERVICE_ID)
+
+        # The order of the properties follows the (arbitrary) order of the entity's dict
+        str_service = str(service)
+        assert str_service.startswith("<Service: ") and str_service.endswith(">")
+        assert set(str_service[len("<Service: "):-1].split(" ")) == {
+            "available_decoys=[]",
+            "name=u'ssh_service'",
+            "service_type_name=u'SSH'",
+            "url=u'{api_url}service/{service_id}/'".format(api_url=OFFLINE_API_URL,
+                                                          service_id=OFFLINE_SERVICE_ID),
+            "is_active=False",
+            "attached_decoys=[]",
+            "any_user=False",
+            "is_delete_enabled=True",
+            "service_type=u'ssh'",
+            "id={service_id}".format(service_id=OFFLINE_SERVICE_ID)
+        }
 
-    def test_get_attribute(self):
-        service = self.services.create(name=SSH_SERVICE_NAME, service_type="ssh", any_user="false")
+    def test_get_attribute(self, offline_client):
+        service = offline_client.services.get_item(OFFLINE_SERVICE_ID)
         assert service.name == SSH_SERVICE_NAME
 
         with pytest.raises(AttributeError):
             _ = service.no_such_attribute
 
-        unloaded_service = Service(self.client, {'id': service.id, 'url': service.url})
+        unloaded_service = Service(offline_client, {'id': service.id, 'url': service.url})
         assert unloaded_service.name == SSH_SERVICE_NAME
 
         with pytest.raises(AttributeError):
@@ -825,9 +980,9 @@ class TestEntity(APITest):
 
         no_such_service_data = {
             'id': service.id + 1,
-            'url': '%s%s/' % (self.client.api_urls['service'], service.id + 1)
+            'url': '%s%s/' % (offline_client.api_urls['service'], service.id + 1)
         }
-        no_such_service = Service(self.client, no_such_service_data)
+        no_such_service = Service(offline_client, no_such_service_data)
 
         with pytest.raises(ValidationError):
             assert no_such_service.name == SSH_SERVICE_NAME
@@ -835,6 +990,99 @@ class TestEntity(APITest):
         with pytest.raises(ValidationError):
             _ = no_such_service.no_such_attribute
 
+    def test_params(self, offline_client):
+        assert type(offline_client.decoys.params()) == dict
+        assert type(offline_client.services.params()) == dict
+        assert type(offline_client.breadcrumbs.params()) == dict
+
+
+class TestCollectionsOffline(object):
+    """
+    Client side tests of the collection requests, against canned responses.
+    """
+
+    def test_count(self, offline_server, offline_client):
+        offline_server.get(OFFLINE_API_URLS['decoy'],
+                           json={'count': 42, 'next': None, 'results': [{'id': 1}]},
+                           headers=JSON_HEADERS)
+
+        assert offline_client.decoys.count() == 42
+        assert len(offline_client.decoys) == 42
+        assert offline_server.last_request.qs == {'per_page': ['1']}
+
+    def test_ids_pagination(self, offline_server, offline_client):
+        decoys_url = OFFLINE_API_URLS['decoy']
+        offline_server.get(decoys_url,
+                           json={'count': 3,
+                                 'next': '%s?page=2' % decoys_url,
+                                 'results': [{'id': 1}, {'id': 2}]},
+                           headers=JSON_HEADERS)
+        offline_server.get('%s?page=2' % decoys_url,
+                           json={'count': 3, 'next': None, 'results': [{'id': 3}]},
+                           headers=JSON_HEADERS)
+
+        assert offline_client.decoys.ids() == [1, 2, 3]
+        assert [decoy.id for decoy in offline_client.decoys] == [1, 2, 3]
+
+        # ids() asks for full pages, and plain iteration uses the server's page size
+        paged_requests = [request for request in offline_server.request_history
+                          if 'per_page' in request.qs]
+        assert [request.qs for request in paged_requests] == [
+            {'per_page': [str(ENTRIES_PER_PAGE)]},
+            {'page': ['2'], 'per_page': [str(ENTRIES_PER_PAGE)]}
+        ]
+
+    def test_unpaginated(self, offline_server, offline_client):
+        offline_server.get(OFFLINE_API_URLS['cidr-mapping'],
+                           json=[{'id': 7}, {'id': 9}],
+                           headers=JSON_HEADERS)
+
+        assert offline_client.cidr_mappings.count() == 2
+        assert offline_client.cidr_mappings.ids() == [7, 9]
+        assert all(isinstance(cidr_mapping, CIDRMapping)
+                   for cidr_mapping in offline_client.cidr_mappings)
+
+    def test_export_filtered_stream(self, offline_server, offline_client, monkeypatch):
+        offline_server.get('%sexport/' % OFFLINE_API_URLS['endpoint'],
+                           text='ip,dns,hostname\r\n1.2.3.4,,host1\r\n1.2.3.5,,host2\r\n')
+
+        assert list(offline_client.endpoints.export_filtered(stream=True)) == \
+            ['ip,dns,hostname', '1.2.3.4,,host1', '1.2.3.5,,host2']
+
+        closed_responses = []
+        monkeypatch.setattr(requests.Response, 'close',
+                            lambda response: closed_responses.append(response))
+
+        # Stopping early must still release the connection
+        export_lines = offline_client.endpoints.export_filtered(stream=True)
+        assert next(export_lines) == 'ip,dns,hostname'
+        export_lines.close()
+        assert len(closed_responses) == 1
+
+        # So must closing it before reading anything
+        export_lines = offline_client.endpoints.export_filtered(stream=True)
+        export_lines.close()
+        assert len(closed_responses) == 2
+
+
+class TestHelpersOffline(object):
+    """
+    Tests of the test helpers themselves, which don't need a MazeRunner server.
+    """
+
+    def test_run_concurrently_failure(self):
+        called_items = []
+
+        def _func(item):
+            called_items.append(item)
+            if item == 0:
+                raise RuntimeError('item %s failed' % item)
+
+        with pytest.raises(RuntimeError):
+            _run_concurrently(_func, range(20))
+
+        assert sorted(called_items) == range(20)
+
 
 class TestBreadcrumb(APITest):
     def test_crud(self):
@@ -872,7 +1120,7 @@ class TestAlertPolicy(APITest):
     def test_crud(self):
         alert_policies = list(self.alert_policies)
         assert len(alert_policies) > 0
-        assert all([isinstance(alert_policy, AlertPolicy) for alert_policy in alert_policies])
+        assert all(isinstance(alert_policy, AlertPolicy) for alert_policy in alert_policies)
 
         rdp_policies = [alert_policy
                         for alert_policy
@@ -884,14 +1132,13 @@ class TestAlertPolicy(APITest):
         rdp_policy = rdp_policies[0]
 
         assert rdp_policy.to_status == 1
-        assert self.alert_policies.get_item(rdp_policy.id).to_status == 1
 
+        # The server's response to the update is loaded into rdp_policy
         rdp_policy.update_to_status(2)
-
-        assert self.alert_policies.get_item(rdp_policy.id).to_status == 2
+        assert rdp_policy.to_status == 2
 
         self.alert_policies.reset_all_to_default()
-        assert self.alert_policies.get_item(rdp_policy.id).to_status == 1
+        assert rdp_policy.load().to_status == 1
 
 
 class TestConnection(APITest):
@@ -926,22 +1173,24 @@ class TestEndpoints(APITest):
     def test_deploy(self):
 
         def _destroy_elements():
-            for cidr_mapping in self.cidr_mappings:
-                cidr_mapping.delete()
+            _run_concurrently(lambda cidr_mapping: cidr_mapping.delete(), list(self.cidr_mappings))
 
-            for ep in self.endpoints:
-                ep.delete()
+            endpoints_ids = [ep.id for ep in self.endpoints]
+            if endpoints_ids:
+                self.endpoints.delete_by_endpoints_ids(endpoints_ids)
 
         def _are_all_tasks_complete():
-            return len(self.background_tasks) == 0
+            return self.background_tasks.count() == 0
 
         def _test_import_endpoint():
 
             _destroy_elements()
 
-            assert len(self.endpoints) == 0
-            assert len(self.cidr_mappings) == 0
-            assert len(self.background_tasks) == 0
+            endpoints_count, cidr_mappings_count, background_tasks_count = _run_concurrently(
+                len, [self.endpoints, self.cidr_mappings, self.background_tasks])
+            assert endpoints_count == 0
+            assert cidr_mappings_count == 0
+            assert background_tasks_count == 0
 
             cidr_mapping = self.cidr_mappings.create(
                 cidr_block='%s/30' % self.lab_endpoint_ip,
@@ -950,9 +1199,10 @@ class TestEndpoints(APITest):
                 active=True
             )
 
-            assert len(self.cidr_mappings) == 1
+            cidr_mappings = list(self.cidr_mappings)
+            assert len(cidr_mappings) == 1
 
-            selected_cidr = list(self.cidr_mappings)[0]
+            selected_cidr = cidr_mappings[0]
 
             assert selected_cidr.cidr_block == cidr_mapping.cidr_block
             assert selected_cidr.deployment_group == cidr_mapping.deployment_group
@@ -965,13 +1215,18 @@ class TestEndpoints(APITest):
 
             wait_until(_are_all_tasks_complete, total_timeout=300)
 
-            assert len(self.cidr_mappings) > 0
-            assert len(self.endpoints) > 0
+            cidr_mappings_count, endpoints_count, no_such_endpoints_count, lab_endpoints = \
+                _call_concurrently(
+                    lambda: len(self.cidr_mappings),
+                    lambda: len(self.endpoints),
+                    lambda: len(self.endpoints.filter(keywords='no.such.thing')),
+                    lambda: list(self.endpoints.filter(keywords=self.lab_endpoint_ip)))
+            assert cidr_mappings_count > 0
+            assert endpoints_count > 0
+            assert no_such_endpoints_count == 0
+            assert len(lab_endpoints) > 0
 
-            assert len(self.endpoints.filter(keywords='no.such.thing')) == 0
-            assert len(self.endpoints.filter(keywords=self.lab_endpoint_ip)) > 0
-
-            return list(self.endpoints.filter(keywords=self.lab_endpoint_ip))[0]
+            return lab_endpoints[0]
 
         def _test_clean(ep):
             with pytest.raises(InvalidInstallMethodError):
@@ -1021,28 +1276,31 @@ class TestEndpoints(APITest):
             assert self.endpoints.get_item(ep.id).deployment_group.id == dep_group.id
 
         def _test_delete():
+            # lab_endpoints queries the server on each len() and iteration
+            lab_endpoints = self.endpoints.filter(self.lab_endpoint_ip)
+
             self.endpoints.filter('no.such.endpoints').delete_filtered()
-            assert len(self.endpoints.filter(self.lab_endpoint_ip)) > 0
-            self.endpoints.filter(self.lab_endpoint_ip).delete_filtered()
-            assert len(self.endpoints.filter(self.lab_endpoint_ip)) == 0
+            assert len(lab_endpoints) > 0
+            lab_endpoints.delete_filtered()
+            assert len(lab_endpoints) == 0
 
-            _test_import_endpoint()
+            # recreate the lab endpoint
+            self.endpoints.create(ip_address=self.lab_endpoint_ip)
 
-            endpoints = list(self.endpoints.filter(self.lab_endpoint_ip))
+            endpoints = list(lab_endpoints)
             assert len(endpoints) > 0
             self.endpoints.delete_by_endpoints_ids([curr_endpoint.id for curr_endpoint in endpoints])
-            assert len(self.endpoints.filter(self.lab_endpoint_ip)) == 0
+            assert len(lab_endpoints) == 0
 
         def _test_data():
-            _test_import_endpoint()
-            csv_data = self.endpoints.export_filtered()
-            pseudo_csv_file = StringIO.StringIO(csv_data)
-            csv_data = csv.reader(pseudo_csv_file, delimiter=',')
-            assert any([
-                len(csv_line) >= 3 and csv_line[2] == self.lab_endpoint_ip
-                for csv_line
-                in csv_data
-            ])
+            self.endpoints.create(ip_address=self.lab_endpoint_ip)
+            # only lines with the lab endpoint's IP are parsed
+            with closing(self.endpoints.export_filtered(stream=True)) as export_lines:
+                lab_endpoint_lines = (line for line in export_lines if self.lab_endpoint_ip in line)
+                csv_data = csv.reader(lab_endpoint_lines, delimiter=',')
+                assert any(len(csv_line) >= 3 and csv_line[2] == self.lab_endpoint_ip
+                           for csv_line
+                           in csv_data)
 
             assert isinstance(self.endpoints.filter_data(), dict)
 
@@ -1075,19 +1333,19 @@ class TestEndpoints(APITest):
         _test_data()
         _test_stop_import()
 
-    def test_create_endpoint(self):
-        for params in [
-            dict(ip_address='1.1.1.1'),
-            dict(dns='endpoint_address.endpoint.local'),
-            dict(hostname='hostname'),
-            dict(dns='endpoint_address.endpoint.local', ip_address='1.1.1.1'),
-        ]:
-            endpoint = self.endpoints.create(**params)
-            assert endpoint
-            for key, value in params.iteritems():
-                assert getattr(endpoint, key) == value
-            assert len(self.endpoints) == 1
-            endpoint.delete()
+    @pytest.mark.parametrize('params', [
+        dict(ip_address='1.1.1.1'),
+        dict(dns='endpoint_address.endpoint.local'),
+        dict(hostname='hostname'),
+        dict(dns='endpoint_address.endpoint.local', ip_address='1.1.1.1'),
+    ], ids=['ip', 'dns', 'hostname', 'dns_and_ip'])
+    def test_create_endpoint(self, params):
+        endpoint = self.endpoints.create(**params)
+        assert endpoint
+        for key, value in params.iteritems():
+            assert getattr(endpoint, key) == value
+        assert len(self.endpoints) == 1
+        endpoint.delete()
 
     def test_create_endpoint_with_deployment_group(self):
         ip_address = "1.1.1.1"
@@ -1096,24 +1354,23 @@ class TestEndpoints(APITest):
         assert endpoint.deployment_group.name == "All Breadcrumbs"
         endpoint.delete()
 
-    def test_create_invalid_endpoint(self):
-        for params, expected_error_message in [
-            (dict(ip_address='1.1.1.1.1'), "Enter a valid IPv4 address."),
-            (dict(dns='A'*256), "Maximum field length is 255 characters"),
-            (dict(hostname='A'*16), "Maximum field length is 15 characters"),
-            (dict(), "You must provide either dns, hostname, or ip address"),
-        ]:
-            try:
-                self.endpoints.create(**params)
-                raise AssertionError, "Creation of the endpoint should raise an exception"
-            except ValidationError as e:
-                error = json.loads(e.message)
-                if params:
-                    for key in params:
-                        assert key in error
-                        assert error[key] == [expected_error_message]
-                else:
-                    assert error["non_field_errors"] == [expected_error_message]
+    @pytest.mark.parametrize('params,expected_error_message', [
+        (dict(ip_address='1.1.1.1.1'), "Enter a valid IPv4 address."),
+        (dict(dns='A'*256), "Maximum field length is 255 characters"),
+        (dict(hostname='A'*16), "Maximum field length is 15 characters"),
+        (dict(), "You must provide either dns, hostname, or ip address"),
+    ], ids=['ip', 'dns', 'hostname', 'no_address'])
+    def test_create_invalid_endpoint(self, params, expected_error_message):
+        with pytest.raises(ValidationError) as exc_info:
+            self.endpoints.create(**params)
+
+        error = json.loads(exc_info.value.message)
+        if params:
+            for key in params:
+                assert key in error
+                assert error[key] == [expected_error_message]
+        else:
+            assert error["non_field_errors"] == [expected_error_message]
 
 
 class TestAuditLog(APITest):
@@ -1128,47 +1385,50 @@ class TestAuditLog(APITest):
         a_week_ago = today + datetime.timedelta(days=-7)
         two_weeks_ago = today + datetime.timedelta(days=-14)
 
-        # check that today has data - start date
-        assert len(self.audit_log.filter(start_date=self._format_time(today))) != 0, \
-            "No data from today according to start date"
-
-        # and that tomorrow doesn't - start date
-        assert len(self.audit_log.filter(start_date=self._format_time(tomorrow))) == 0, \
-            "Data from tomorrow found!"
-
-        # check that today has data - end date
-        assert len(self.audit_log.filter(end_date=self._format_time(today))) != 0, \
-            "No data from today according to end date"
+        # (date filters, whether logs are expected, error message)
+        time_queries = [
+            # check that today has data - start date
+            (dict(start_date=today), True, "No data from today according to start date"),
+            # and that tomorrow doesn't - start date
+            (dict(start_date=tomorrow), False, "Data from tomorrow found!"),
+            # check that today has data - end date
+            (dict(end_date=today), True, "No data from today according to end date"),
+            # and that last week doesn't - end date
+            (dict(end_date=a_week_ago), False,
+             "Data from a week ago found, even though we deleted everything!"),
+            # test time range
+            (dict(start_date=a_week_ago, end_date=today), True, "No logs from the past week"),
+            (dict(start_date=two_weeks_ago, end_date=a_week_ago), False,
+             "Logs found from two weeks ago."),
+        ]
 
-        # and that last week doesn't - end date
-        assert len(self.audit_log.filter(end_date=self._format_time(a_week_ago))) == 0, \
-            "Data from a week ago found, even though we deleted everything!"
+        def _count_logs(date_filters):
+            return len(self.audit_log.filter(**{name: self._format_time(date)
+                                                for name, date
+                                                in date_filters.iteritems()}))
 
-        # test time range
-        assert len(self.audit_log.filter(start_date=self._format_time(a_week_ago),
-                                         end_date=self._format_time(today))) != 0, \
-            "No logs from the past week"
+        log_counts = _run_concurrently(_count_logs,
+                                       [date_filters for date_filters, _, _ in time_queries])
 
-        assert len(self.audit_log.filter(start_date=self._format_time(two_weeks_ago),
-                                         end_date=self._format_time(a_week_ago))) == 0, \
-            "Logs found from two weeks ago."
+        for (_, logs_expected, error_message), log_count in zip(time_queries, log_counts):
+            assert (log_count != 0) == logs_expected, error_message
 
-    def _test_object_ids_queries(self, log_count):
-        # get obj ids from server
-        object_ids = [log_line._param_dict.get("object_ids") for log_line in self.audit_log]
-        # and extract them
-        object_ids = list(set([object_id[0] if object_id else None for object_id in object_ids]))
+    def _test_object_ids_queries(self, log_lines):
+        # get the obj ids from the fetched logs and extract them in a single pass
+        object_ids = {object_id[0] if object_id else None
+                      for object_id
+                      in (log_line._param_dict.get("object_ids") for log_line in log_lines)}
 
         # and make sure you have enough obj ids
         assert len(object_ids) >= 2, "No more than 1 object ID in the system"
 
         # test that you don't get all the alerts when filtering
-        usable_object_id = [object_id for object_id in object_ids if object_id][0]
+        usable_object_id = next(object_id for object_id in object_ids if object_id)
 
-        assert len(self.audit_log.filter(object_ids=usable_object_id)) != log_count, \
+        assert len(self.audit_log.filter(object_ids=usable_object_id)) != len(log_lines), \
             "Object ID filter returned the same amount of logs as the full filter"
 
-    def _test_username_queries(self, log_count):
+    def _test_username_queries(self, log_lines):
         user_id = self.client._auth.credentials['id']
 
         # make sure that if the username is right you get data
@@ -1186,9 +1446,9 @@ class TestAuditLog(APITest):
         with pytest.raises(BadParamError):
             self.audit_log.filter(username=user_id)
 
-    def _test_category_queries(self, log_count):
-        # get categories from server
-        categories = list(set([log_line._param_dict.get("category") for log_line in self.audit_log]))
+    def _test_category_queries(self, log_lines):
+        # get categories from the fetched logs
+        categories = list({log_line._param_dict.get("category") for log_line in log_lines})
 
         # and make sure you have enough
         assert len(categories) >= 2, "No more than 1 category in the system"
@@ -1198,16 +1458,16 @@ class TestAuditLog(APITest):
             "No logs for previously existing filter value"
 
         # test that you don't get all the alerts when filtering
-        assert len(self.audit_log.filter(category=[categories[0]])) != log_count, \
+        assert len(self.audit_log.filter(category=[categories[0]])) != len(log_lines), \
             "Filtered list returned the same amount of logs as the full filter"
 
         # test categories not list ERR
         with pytest.raises(BadParamError):
             self.audit_log.filter(category=categories[0])
 
-    def _test_event_type_queries(self, log_count):
-        # get event_types from server
-        event_types = list(set([log_line._param_dict.get("event_type_label") for log_line in self.audit_log]))
+    def _test_event_type_queries(self, log_lines):
+        # get event_types from the fetched logs
+        event_types = list({log_line._param_dict.get("event_type_label") for log_line in log_lines})
 
         # and make sure you have enough
         assert len(event_types) >= 2, "No more than 1 event type in the system."
@@ -1217,7 +1477,7 @@ class TestAuditLog(APITest):
             "No logs for previously existing filter value"
 
         # test that you don't get all the alerts when filtering
-        assert len(self.audit_log.filter(event_type=[event_types[0]])) != log_count, \
+        assert len(self.audit_log.filter(event_type=[event_types[0]])) != len(log_lines), \
             "Filtered list returned the same amount of logs as the full filter"
 
         # test event type not list ERR
@@ -1227,25 +1487,28 @@ class TestAuditLog(APITest):
     def test_audit_log_query(self):
 
         # test delete (at the start for a clean log)
+        # Note: this can't be replaced by filtering on the test's start time, since the audit log
+        # filters have a resolution of a day (ISO_TIME_FORMAT) and the time based queries below
+        # rely on having no logs older than today
         self.audit_log.delete()
         logger.info("Audit log cleared")
 
         # build all sorts of logs
-        decoy_ssh = self.create_decoy(dict(name=SSH_DECOY_NAME,
-                                           hostname="decoyssh",
-                                           os="Ubuntu_1404",
-                                           vm_type="KVM"))
+        self.create_decoy(dict(name=SSH_DECOY_NAME,
+                               hostname="decoyssh",
+                               os="Ubuntu_1404",
+                               vm_type="KVM"))
 
         # test query
-        log_count = self.audit_log
-        assert len(log_count) != 0, "No logs found"
-        assert type(list(self.audit_log)[0]) == AuditLogLine, "Invalid output"
+        log_lines = list(self.audit_log)
+        assert len(log_lines) != 0, "No logs found"
+        assert type(log_lines[0]) == AuditLogLine, "Invalid output"
 
         self._test_time_based_queries()
-        self._test_object_ids_queries(log_count)
-        self._test_username_queries(log_count)
-        self._test_category_queries(log_count)
-        self._test_event_type_queries(log_count)
+        self._test_object_ids_queries(log_lines)
+        self._test_username_queries(log_lines)
+        self._test_category_queries(log_lines)
+        self._test_event_type_queries(log_lines)
 
         # test filter=False with params
         assert len(self.audit_log.filter(event_type=["Delete"], filter_enabled=False)) == \
@@ -1,5 +1,8 @@
+import random
 import time
 
+from monotonic import monotonic
+
 
 class TimeoutException(Exception):
     pass
@@ -11,28 +14,38 @@ def wait_until(func,
                interval=0.5,
                exc_list=None,
                error_message="",
+               backoff=2.0,
+               max_interval=10.0,
                *args,
                **kwargs):
     """
     Waits until func(*args, **kwargs),
-    until total_timeout seconds,
-    for interval seconds interval,
+    until total_timeout seconds (func is always called at least once),
+    starting with interval seconds between calls and multiplying it by backoff
+    after each call, up to max_interval seconds (each sleep is randomized by +-20%,
+    without exceeding max_interval),
     while catching exceptions given in exc_list.
+    Returns the last value returned by func.
     """
-    start_function = time.time()
-    while time.time() - start_function < total_timeout:
+    exc_tuple = tuple(exc_list) if exc_list else ()
+    current_interval = interval
+    start_function = monotonic()
+    while True:
 
         try:
             return_value = func(*args, **kwargs)
-            if not check_return_value or (check_return_value and return_value):
-                return
+            if not check_return_value or return_value:
+                return return_value
+
+        except exc_tuple:
+            pass
 
-        except Exception as e:
-            if exc_list and any([isinstance(e, x) for x in exc_list]):
-                pass
-            else:
-                raise
+        remaining_time = total_timeout - (monotonic() - start_function)
+        if remaining_time <= 0:
+            break
 
-        time.sleep(interval)
+        # jitter the sleep, but never past max_interval or the deadline
+        time.sleep(min(current_interval * random.uniform(0.8, 1.2), max_interval, remaining_time))
+        current_interval = min(current_interval * backoff, max_interval)
 
-    raise TimeoutException, error_message
+    raise TimeoutException(error_message)